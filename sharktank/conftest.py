@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
 from pathlib import Path
+import functools
 import pytest
 import re
 
@@ -401,6 +402,12 @@ def evaluate_mark_conditions(item: pytest.Item, mark: pytest.Mark) -> bool:
     return any(evaluate_condition(item, mark, condition)[0] for condition in conditions)
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_xfail_match(match: str) -> re.Pattern:
+    # The same xfail marks are matched for every parametrization of a test.
+    return re.compile(match)
+
+
 @pytest.hookimpl(wrapper=True)
 def pytest_runtest_makereport(
     item: pytest.Item, call: pytest.CallInfo[None]
@@ -438,7 +445,7 @@ def pytest_runtest_makereport(
                 ) or not evaluate_mark_conditions(item, xfail_mark):
                     continue
 
-                if not re.search(match, str(call.excinfo.value)):
+                if not _compile_xfail_match(match).search(str(call.excinfo.value)):
                     report.outcome = "failed"
                     break
 
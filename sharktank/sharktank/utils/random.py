@@ -12,16 +12,33 @@ import random
 import torch
 
 
-# Range of torch.rand() is [0,1)
-# Range of torch.rand() * 2 - 1 is [-1, 1), includes negative values
-def make_rand_torch(shape: list[int], dtype: Optional[torch.dtype] = torch.float32):
-    return (torch.rand(shape) * 2 - 1).to(dtype=dtype)
-
-
-def make_random_mask(shape: tuple[int], dtype: Optional[torch.dtype] = None):
-    mask = make_rand_torch(shape=shape, dtype=dtype)
-    mask = (mask >= 0).to(dtype=dtype)
-    return mask
+# Range of the generated values is [-1, 1), includes negative values.
+# Pass `device` to generate directly on the device that consumes the tensor
+# instead of generating on the CPU and copying.
+def make_rand_torch(
+    shape: list[int],
+    dtype: Optional[torch.dtype] = torch.float32,
+    device: Optional[torch.device | str] = None,
+):
+    if dtype is None or (dtype.is_floating_point and torch.finfo(dtype).bits >= 32):
+        # Sample directly in the target dtype to avoid an FP32 temporary and a cast.
+        # Narrower dtypes keep the FP32 draw, since sampling them directly only
+        # uses as many random bits as their mantissa and coarsens values near 0.
+        return torch.empty(shape, dtype=dtype, device=device).uniform_(-1, 1)
+    return (torch.rand(shape, device=device) * 2 - 1).to(dtype=dtype)
+
+
+def make_random_mask(
+    shape: tuple[int],
+    dtype: Optional[torch.dtype] = None,
+    device: Optional[torch.device | str] = None,
+):
+    if dtype is not None and dtype.is_floating_point:
+        return torch.empty(shape, dtype=dtype, device=device).bernoulli_(0.5)
+    # Without a dtype the mask is boolean.
+    return (
+        torch.empty(shape, device=device).bernoulli_(0.5).to(dtype=dtype or torch.bool)
+    )
 
 
 @contextmanager
@@ -6,6 +6,7 @@
 
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Tuple, Union
+import concurrent.futures
 import contextlib
 from pathlib import Path
 import numpy as np
@@ -21,6 +22,9 @@ from typing import Any, Callable
 from operator import eq
 from collections.abc import Iterable
 import gc
+import json
+import math
+import mmap
 import random
 import torch
 import inspect
@@ -81,14 +85,58 @@ def is_iree_hal_target_device_cpu(v: str, /) -> bool:
     return v.startswith("local") or v == "llvm-cpu"
 
 
+SHARKTANK_KEEP_TMPDIRS_ENV_VAR = "SHARKTANK_KEEP_TMPDIRS"
+
+
+def _keep_tmpdirs() -> bool:
+    return os.getenv(SHARKTANK_KEEP_TMPDIRS_ENV_VAR, "0") not in ["", "0"]
+
+
 class TempDirTestBase(unittest.TestCase):
+    """Provides each test with a fresh temporary directory in `self._temp_dir`.
+
+    Subclasses that need the same files in every test can override
+    `_populate_template`. The template is built once per class and copied into
+    each test's directory.
+
+    Set the env var SHARKTANK_KEEP_TMPDIRS=1 to not delete the directories."""
+
+    _template_dir: Path | None = None
+
+    @classmethod
+    def _populate_template(cls, template_dir: Path):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Only pay for a template if a subclass actually populates one.
+        if (
+            cls._populate_template.__func__
+            is not TempDirTestBase._populate_template.__func__
+        ):
+            cls._template_dir = Path(
+                tempfile.mkdtemp(prefix=f"{cls.__qualname__}_template_")
+            )
+            cls._populate_template(cls._template_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls._template_dir is not None and not _keep_tmpdirs():
+            shutil.rmtree(cls._template_dir, ignore_errors=True)
+        cls._template_dir = None
+        super().tearDownClass()
+
     def setUp(self):
         super().setUp()
         self._temp_dir = Path(tempfile.mkdtemp(type(self).__qualname__))
+        if self._template_dir is not None:
+            shutil.copytree(self._template_dir, self._temp_dir, dirs_exist_ok=True)
 
     def tearDown(self):
         gc.collect()
-        shutil.rmtree(self._temp_dir, ignore_errors=True)
+        if not _keep_tmpdirs():
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
 
 
 class MainRunnerTestBase(TempDirTestBase):
@@ -404,7 +452,7 @@ def temporary_directory(identifier: str):
 
     If the env var SHARKTANK_TEST_ASSETS_DIR is set then directories will be
     created under there, named by `identifier`. If the `identifier` subdirectory
-    exists, it will be deleted first.
+    exists, its contents will be deleted first.
 
     This is useful for getting updated goldens and such.
     """
@@ -415,11 +463,22 @@ def temporary_directory(identifier: str):
     else:
         explicit_path = Path(explicit_dir) / identifier
         if explicit_path.exists():
-            shutil.rmtree(explicit_path)
-        explicit_path.mkdir(parents=True, exist_ok=True)
+            _empty_dir(explicit_path)
+        else:
+            explicit_path.mkdir(parents=True, exist_ok=True)
         yield explicit_path
 
 
+def _empty_dir(path: PathLike):
+    """Deletes the contents of a directory, but not the directory itself."""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+
+
 @contextlib.contextmanager
 def override_debug_flags(flag_updates: dict):
     from .debugging import flags
@@ -438,14 +497,29 @@ def override_debug_flags(flag_updates: dict):
             setattr(flags, k, v)
 
 
-def get_best_torch_device() -> str:
+SHARKTANK_FORCE_DEVICE_ENV_VAR = "SHARKTANK_FORCE_DEVICE"
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_best_torch_device() -> str:
     import torch
 
-    if torch.cuda.is_available() and torch.cuda.device_count() > 0:
+    if torch.cuda.device_count() > 0 and torch.cuda.is_available():
         return "cuda:0"
     return "cpu"
 
 
+def get_best_torch_device() -> str:
+    """Returns "cuda:0" if a GPU is available and "cpu" otherwise.
+
+    The device probing is done only once per process. Set the env var
+    SHARKTANK_FORCE_DEVICE to use a specific device without probing."""
+    forced_device = os.getenv(SHARKTANK_FORCE_DEVICE_ENV_VAR)
+    if forced_device:
+        return forced_device
+    return _detect_best_torch_device()
+
+
 def assert_dicts_equal(
     dict1: dict, dict2: dict, *, values_equal: Callable[[Any, Any], bool] | None = None
 ) -> None:
@@ -482,7 +556,6 @@ def assert_close_safetensors(
 
     actual_path and ref_path can be directories. In that case files with matching
     sub-paths will be compared."""
-    from safetensors import safe_open
     import torch
 
     print(f"Asserting tensors close: actual={actual_path}, ref={ref_path}")
@@ -493,37 +566,78 @@ def assert_close_safetensors(
     assert ref_path.exists(), f'Path "{ref_path}" not found'
 
     if not ref_path.is_file():
-        # Get all files in ref_path recursively.
-        ref_file_paths: list[Path] = [
-            file_path
-            for file_path in Path(ref_path).rglob("*.safetensors")
-            if file_path.is_file()
-        ]
+        # Get all files in ref_path recursively, along with their timestamps.
+        ref_files = list(_iter_safetensors_files(ref_path))
 
-        # Sort by timestamp. When we compare traces we want to order by time.
-        ref_file_paths.sort(key=lambda file_path: os.stat(file_path).st_mtime_ns)
+        # Sort by timestamp. When we compare traces we want to report in time order.
+        ref_files.sort(key=lambda file_and_mtime: file_and_mtime[1])
+        ref_file_paths: list[Path] = [file_path for file_path, _ in ref_files]
 
         ref_actual_file_path_map: dict[Path, Path] = {
             ref_file_path: Path(actual_path) / ref_file_path.relative_to(ref_path)
             for ref_file_path in ref_file_paths
         }
 
-        not_close_list: list[tuple[Path, Path]] = []
-        for ref_file_path, actual_file_path in ref_actual_file_path_map.items():
-            try:
-                assert os.path.isfile(actual_file_path)
-                assert_close_safetensors(
+        def assert_file_close(
+            actual_file_path: Path, ref_file_path: Path, log: Callable[[str], None]
+        ):
+            log(
+                f"Asserting tensors close: actual={actual_file_path}, ref={ref_file_path}"
+            )
+            assert os.path.isfile(actual_file_path), f'"{actual_file_path}" not found'
+            _assert_close_safetensors_file(
+                actual_file_path,
+                ref_file_path,
+                rtol=rtol,
+                atol=atol,
+                fail_fast=fail_fast,
+                check_dtype=check_dtype,
+                log=log,
+            )
+
+        # Files are independent. Most of the work happens in torch native code,
+        # which releases the GIL, so threads are enough.
+        # The output of each file is buffered and printed in timestamp order
+        # afterwards, so that it does not interleave.
+        file_logs: dict[Path, list[str]] = {
+            ref_file_path: [] for ref_file_path in ref_actual_file_path_map
+        }
+        not_close_set: set[Path] = set()
+        fail_fast_ex: Exception | None = None
+        max_workers = max(min(os.cpu_count() or 1, len(ref_actual_file_path_map)), 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_ref_file_path = {
+                executor.submit(
+                    assert_file_close,
                     actual_file_path,
                     ref_file_path,
-                    rtol=rtol,
-                    atol=atol,
-                    fail_fast=fail_fast,
-                    check_dtype=check_dtype,
-                )
-            except Exception as ex:
+                    file_logs[ref_file_path].append,
+                ): ref_file_path
+                for ref_file_path, actual_file_path in ref_actual_file_path_map.items()
+            }
+            for future in concurrent.futures.as_completed(future_to_ref_file_path):
+                ex = future.exception()
+                if ex is None:
+                    continue
+                not_close_set.add(future_to_ref_file_path[future])
                 if fail_fast:
-                    raise
-                not_close_list.append((actual_file_path, ref_file_path))
+                    for pending_future in future_to_ref_file_path:
+                        pending_future.cancel()
+                    fail_fast_ex = ex
+                    break
+
+        for lines in file_logs.values():
+            for line in lines:
+                print(line)
+
+        if fail_fast_ex is not None:
+            raise fail_fast_ex
+
+        not_close_list: list[tuple[Path, Path]] = [
+            (actual_file_path, ref_file_path)
+            for ref_file_path, actual_file_path in ref_actual_file_path_map.items()
+            if ref_file_path in not_close_set
+        ]
 
         if len(not_close_list) > 0:
             print("Not close:")
@@ -532,41 +646,317 @@ def assert_close_safetensors(
             assert False, "Tensors are not close."
         return
 
-    def print_stats(label: str, t: torch.Tensor):
-        t_f32 = t.to(dtype=torch.float32)
-        std, mean = torch.std_mean(t_f32)
-        print(
-            f"    {label}: "
-            f"MIN={torch.min(t_f32)}, "
-            f"MAX={torch.max(t_f32)}, "
-            f"MEAN={mean}, STD={std}, "
-            f"DTYPE={t.dtype}"
+    _assert_close_safetensors_file(
+        actual_path,
+        ref_path,
+        rtol=rtol,
+        atol=atol,
+        fail_fast=fail_fast,
+        check_dtype=check_dtype,
+        log=print,
+    )
+
+
+def _assert_close_safetensors_file(
+    actual_path: Path,
+    ref_path: Path,
+    *,
+    rtol: Optional[float],
+    atol: Optional[float],
+    fail_fast: bool,
+    check_dtype: bool,
+    log: Callable[[str], None],
+):
+    """Compares a single pair of safetensors files.
+
+    Without `fail_fast` all tensors are compared and an AssertionError listing
+    the tensors that are not close is raised at the end."""
+    # Map each file once and read its header once. Tensors are zero-copy views
+    # into the mapped files.
+    ref_header, ref_data = _mmap_safetensors(ref_path)
+    actual_header, actual_data = _mmap_safetensors(actual_path)
+    ref_names = sorted(ref_header.keys())
+    missing_names = [name for name in ref_names if name not in actual_header]
+    assert (
+        len(missing_names) == 0
+    ), f"Tensors {missing_names} not found in {actual_path}"
+
+    not_close_names: list[str] = []
+    for name in ref_names:
+        log(f":: Comparing tensor {name}")
+        ref_info = ref_header[name]
+        actual_info = actual_header[name]
+        iter_chunk_pairs = functools.partial(
+            _iter_safetensors_chunk_pairs, ref_data, ref_info, actual_data, actual_info
+        )
+        # An unsupported dtype is not a comparison failure, so it is raised before
+        # any statistics are attempted.
+        _get_safetensors_dtype(ref_info["dtype"])
+        _get_safetensors_dtype(actual_info["dtype"])
+        try:
+            ref_shape = ref_info["shape"]
+            actual_shape = actual_info["shape"]
+            assert (
+                actual_shape == ref_shape
+            ), f"Shape mismatch for tensor {name}: {actual_shape} != {ref_shape}"
+            start_row = 0
+            for ref, actual in iter_chunk_pairs():
+                end_row = start_row + (ref.shape[0] if ref.dim() > 0 else 0)
+                # Only build the detailed comparison when the chunk may differ.
+                if not _is_close_fast_path(actual, ref, rtol=rtol, atol=atol):
+                    try:
+                        torch.testing.assert_close(
+                            actual, ref, rtol=rtol, atol=atol, check_dtype=check_dtype
+                        )
+                    except AssertionError as ex:
+                        if ref.dim() == 0:
+                            raise
+                        # The message of assert_close only describes the chunk.
+                        raise AssertionError(
+                            f"Tensor {name} is not close in rows "
+                            f"[{start_row}, {end_row}). Indices and element counts "
+                            f"below are relative to that row range.\n{ex}"
+                        ) from None
+                start_row = end_row
+        except Exception as ex:
+            # Statistics are only computed for tensors that are not close.
+            _print_safetensors_chunk_pairs_stats(iter_chunk_pairs(), log=log)
+            if fail_fast:
+                raise
+            log(str(ex))
+            not_close_names.append(name)
+
+    assert (
+        len(not_close_names) == 0
+    ), f"Tensors {not_close_names} in {actual_path} are not close to {ref_path}"
+
+
+def _iter_safetensors_files(root: PathLike) -> Iterable[tuple[Path, int]]:
+    """Recursively yield (path, mtime in ns) of all *.safetensors files under
+    `root`. Like Path.rglob, symlinks to directories are not followed."""
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.name.endswith(".safetensors") and entry.is_file():
+                    yield Path(entry.path), entry.stat().st_mtime_ns
+
+
+# Default tolerances of torch.testing.assert_close for floating-point dtypes.
+# See torch.testing._comparison._DTYPE_PRECISIONS.
+_ASSERT_CLOSE_DEFAULT_TOLERANCES: dict[torch.dtype, tuple[float, float]] = {
+    torch.float16: (1e-3, 1e-5),
+    torch.bfloat16: (1.6e-2, 1e-5),
+    torch.float32: (1.3e-6, 1e-5),
+    torch.float64: (1e-7, 1e-7),
+}
+
+
+def _is_close_fast_path(
+    actual: torch.Tensor,
+    expected: torch.Tensor,
+    rtol: float | None,
+    atol: float | None,
+) -> bool:
+    """Returns True only if torch.testing.assert_close(actual, expected, rtol=rtol,
+    atol=atol) would pass. False is inconclusive.
+
+    This is a single torch.allclose that does not build any diagnostics."""
+    if actual.dtype != expected.dtype or actual.shape != expected.shape:
+        return False
+    if rtol is None and atol is None:
+        if expected.dtype not in _ASSERT_CLOSE_DEFAULT_TOLERANCES:
+            return False
+        rtol, atol = _ASSERT_CLOSE_DEFAULT_TOLERANCES[expected.dtype]
+    elif rtol is None or atol is None:
+        return False
+    return torch.allclose(actual, expected, rtol=rtol, atol=atol, equal_nan=False)
+
+
+_SAFETENSORS_COMPARE_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+_SAFETENSORS_DTYPES: dict[str, torch.dtype] = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U64": torch.uint64,
+    "U32": torch.uint32,
+    "U16": torch.uint16,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _get_safetensors_dtype(safetensors_dtype: str) -> torch.dtype:
+    try:
+        return _SAFETENSORS_DTYPES[safetensors_dtype]
+    except KeyError:
+        raise NotImplementedError(
+            f'Comparing safetensors of dtype "{safetensors_dtype}" is not supported'
+        ) from None
+
+
+def _mmap_safetensors(path: PathLike) -> tuple[dict[str, dict], memoryview]:
+    """Memory-maps a safetensors file.
+
+    Returns the tensor entries of the header, keyed by tensor name, and a view
+    of the data section that the entries' `data_offsets` are relative to.
+    The mapping is released once the view and all tensors created from it are
+    garbage collected."""
+    with open(path, "rb") as f:
+        # Copy-on-write, so that torch.frombuffer gets a writable buffer.
+        # Nothing is ever written back to the file.
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = int.from_bytes(mm[:8], byteorder="little")
+    header = json.loads(mm[8 : 8 + header_size])
+    header.pop("__metadata__", None)
+    return header, memoryview(mm)[8 + header_size :]
+
+
+def _safetensors_tensor(
+    data: memoryview, info: dict, start_row: int = 0, end_row: int | None = None
+) -> torch.Tensor:
+    """Zero-copy tensor of rows [start_row, end_row) of a safetensors header entry.
+
+    Rank-0 tensors are always returned whole."""
+    dtype = _get_safetensors_dtype(info["dtype"])
+    shape = list(info["shape"])
+    begin, end = info["data_offsets"]
+    if len(shape) > 0:
+        end_row = shape[0] if end_row is None else min(end_row, shape[0])
+        start_row = min(start_row, end_row)
+        row_bytes = math.prod(shape[1:]) * dtype.itemsize
+        begin, end = begin + start_row * row_bytes, begin + end_row * row_bytes
+        shape[0] = end_row - start_row
+    if begin == end:
+        return torch.empty(shape, dtype=dtype)
+    return torch.frombuffer(data[begin:end], dtype=dtype).reshape(shape)
+
+
+def _safetensors_rows_per_chunk(info: dict, chunk_bytes: int | None = None) -> int:
+    """Number of leading-dimension rows of a safetensors header entry that fit in a
+    chunk of `chunk_bytes`.
+
+    A chunk always has at least one row, even if it is larger than `chunk_bytes`."""
+    if chunk_bytes is None:
+        chunk_bytes = _SAFETENSORS_COMPARE_CHUNK_BYTES
+    shape = info["shape"]
+    row_bytes = math.prod(shape[1:]) * _get_safetensors_dtype(info["dtype"]).itemsize
+    return max(chunk_bytes // max(row_bytes, 1), 1)
+
+
+def _iter_safetensors_chunk_pairs(
+    ref_data: memoryview, ref_info: dict, actual_data: memoryview, actual_info: dict
+) -> Iterable[tuple[torch.Tensor, torch.Tensor]]:
+    """Yield corresponding (ref, actual) blocks along the first dimension of a
+    tensor. Both tensors are split at the same rows."""
+    if len(ref_info["shape"]) == 0 or len(actual_info["shape"]) == 0:
+        yield (
+            _safetensors_tensor(ref_data, ref_info),
+            _safetensors_tensor(actual_data, actual_info),
+        )
+        return
+    rows_per_chunk = _safetensors_rows_per_chunk(ref_info)
+    for start in range(0, ref_info["shape"][0], rows_per_chunk):
+        end = start + rows_per_chunk
+        yield (
+            _safetensors_tensor(ref_data, ref_info, start, end),
+            _safetensors_tensor(actual_data, actual_info, start, end),
         )
 
-    with safe_open(actual_path, framework="pt") as actual_f, safe_open(
-        ref_path, framework="pt"
-    ) as ref_f:
-        # Print all first.
-        for name in ref_f.keys():
-            actual = actual_f.get_tensor(name)
-            ref = ref_f.get_tensor(name)
-
-            print(f":: Comparing tensor {name}")
-            print_stats(" REF", ref)
-            print_stats(" ACT", actual)
-            print_stats("DIFF", (ref - actual))
-        # Then assert.
-        for name in ref_f.keys():
-            actual = actual_f.get_tensor(name)
-            ref = ref_f.get_tensor(name)
-            try:
-                torch.testing.assert_close(
-                    actual, ref, rtol=rtol, atol=atol, check_dtype=check_dtype
-                )
-            except Exception as ex:
-                if fail_fast:
-                    raise
-                print(ex)
+
+def _print_safetensors_chunk_pairs_stats(
+    chunk_pairs: Iterable[tuple[torch.Tensor, torch.Tensor]],
+    log: Callable[[str], None] = print,
+):
+    ref_stats = _StreamingTensorStats()
+    actual_stats = _StreamingTensorStats()
+    diff_stats = _StreamingTensorStats()
+    for ref, actual in chunk_pairs:
+        ref_stats.update(ref)
+        actual_stats.update(actual)
+        if ref.shape == actual.shape:
+            diff_stats.update(ref - actual)
+    log(ref_stats.format(" REF"))
+    log(actual_stats.format(" ACT"))
+    log(diff_stats.format("DIFF"))
+
+
+_STATS_SUB_CHUNK_NUMEL = 1 << 20
+
+
+class _StreamingTensorStats:
+    """Accumulates min/max/mean/std over a tensor that is fed in chunks.
+
+    Mean and variance are merged across chunks with Chan's parallel variant of
+    Welford's algorithm. FP32 and FP64 chunks are reduced as they are. Other dtypes
+    are upcast to FP32 in small sub-chunks, so that the temporary copy stays
+    bounded by `_STATS_SUB_CHUNK_NUMEL` elements instead of the whole chunk."""
+
+    def __init__(self):
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.dtype = None
+
+    def update(self, t: torch.Tensor):
+        self.dtype = t.dtype
+        if t.dtype in [torch.float32, torch.float64]:
+            self._merge(t)
+            return
+        for sub_chunk in t.reshape(-1).split(_STATS_SUB_CHUNK_NUMEL):
+            self._merge(sub_chunk.to(dtype=torch.float32))
+
+    def _merge(self, t: torch.Tensor):
+        n = t.numel()
+        if n == 0:
+            return
+        chunk_min, chunk_max = torch.aminmax(t)
+        chunk_var, chunk_mean = torch.var_mean(t, correction=0)
+        chunk_min, chunk_max = chunk_min.item(), chunk_max.item()
+        chunk_mean, chunk_m2 = chunk_mean.item(), chunk_var.item() * n
+
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        total = self.count + n
+        delta = chunk_mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    @property
+    def mean(self) -> float:
+        if self.count == 0:
+            return float("nan")
+        return self._mean
+
+    @property
+    def std(self) -> float:
+        # Unbiased, to match torch.std.
+        if self.count < 2:
+            return float("nan")
+        return (self._m2 / (self.count - 1)) ** 0.5
+
+    def format(self, label: str) -> str:
+        return (
+            f"    {label}: "
+            f"MIN={self.min}, "
+            f"MAX={self.max}, "
+            f"MEAN={self.mean}, STD={self.std}, "
+            f"DTYPE={self.dtype}"
+        )
 
 
 def assert_iterables_equal(
@@ -654,8 +1044,8 @@ def assert_tensor_close(
 
         if inlier_atol is not None:
             # TODO: handle trees
-            outliers = (actual - expected).abs() > inlier_atol
-            outliers_fraction = outliers.count_nonzero() / outliers.numel()
+            num_outliers = _count_outliers(actual, expected, inlier_atol)
+            outliers_fraction = num_outliers / max(actual.numel(), 1)
             if outliers_fraction > max_outliers_fraction:
                 raise AssertionError(
                     f"The fraction of outliers {outliers_fraction:%} is above the allowed "
@@ -686,6 +1076,27 @@ def assert_tensor_close(
         raise AssertionError(msg) from ex
 
 
+_OUTLIERS_CHUNK_NUMEL = 1 << 22
+
+
+def _count_outliers(
+    actual: torch.Tensor, expected: torch.Tensor, inlier_atol: float
+) -> int:
+    """Count the elements where abs(actual - expected) > inlier_atol.
+
+    Works over flat chunks so that no full-size difference or mask tensor is
+    allocated."""
+    num_outliers = torch.zeros([], dtype=torch.int64, device=actual.device)
+    for actual_chunk, expected_chunk in zip(
+        actual.reshape(-1).split(_OUTLIERS_CHUNK_NUMEL),
+        expected.reshape(-1).split(_OUTLIERS_CHUNK_NUMEL),
+    ):
+        abs_diff = (actual_chunk - expected_chunk).abs_()
+        # Count out of place in int64. A 0/1 mask summed in fp16/bf16 is inexact.
+        num_outliers += abs_diff.gt(inlier_atol).sum(dtype=torch.int64)
+    return num_outliers.item()
+
+
 def assert_cosine_similarity_close(
     actual: AnyTensor,
     expected: AnyTensor,
@@ -798,26 +1209,34 @@ def _eval_condition(c: bool | str | None) -> bool:
     )
 
 
-def get_random_test_text_prompts(
-    num_prompts: int, min_prompt_length: int | None = None
-):
+@functools.lru_cache(maxsize=8)
+def _load_test_text_prompts(min_prompt_length: int | None) -> tuple[str, ...]:
     prompts = load_dataset("wikitext", "wikitext-2-raw-v1", split="test")["text"]
     if min_prompt_length is not None:
         prompts = [p for p in prompts if len(p) >= min_prompt_length]
-    return random.sample(prompts, num_prompts)
+    return tuple(prompts)
+
+
+def get_random_test_text_prompts(
+    num_prompts: int, min_prompt_length: int | None = None
+):
+    return random.sample(_load_test_text_prompts(min_prompt_length), num_prompts)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_frozen_test_text_prompts(
+    num_prompts: int, min_prompt_length: int | None
+) -> tuple[str, ...]:
+    # A dedicated RNG produces the same sample as seeding the global one, without
+    # saving and restoring the global state.
+    rng = random.Random(13910398)
+    return tuple(rng.sample(_load_test_text_prompts(min_prompt_length), num_prompts))
 
 
 def get_frozen_test_text_prompts(
     num_prompts: int, min_prompt_length: int | None = None
 ):
-    orig_rng_state = random.getstate()
-    try:
-        random.seed(13910398)
-        return get_random_test_text_prompts(
-            num_prompts=num_prompts, min_prompt_length=min_prompt_length
-        )
-    finally:
-        random.setstate(orig_rng_state)
+    return list(_get_frozen_test_text_prompts(num_prompts, min_prompt_length))
 
 
 _test_prompts = None
@@ -5,12 +5,20 @@
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
 import copy
+import json
 import pytest
 import torch
 import re
+import shutil
+import unittest
 
 from pathlib import Path
-from sharktank.utils.testing import assert_tensor_close
+from sharktank.utils.testing import (
+    SHARKTANK_KEEP_TMPDIRS_ENV_VAR,
+    TempDirTestBase,
+    assert_close_safetensors,
+    assert_tensor_close,
+)
 
 pytest_plugins = "pytester"
 
@@ -110,6 +118,222 @@ class TestAssertTensorClose:
         ):
             assert_tensor_close(actual, expected)
 
+    def test_outliers_fraction_within_limit(self):
+        expected = torch.zeros(100, dtype=torch.float32)
+        actual = expected.clone()
+        actual[:5] = 0.5
+        assert_tensor_close(
+            actual,
+            expected,
+            rtol=0,
+            atol=1,
+            max_outliers_fraction=0.05,
+            inlier_atol=0.1,
+        )
+
+    def test_outliers_fraction_above_limit(self):
+        expected = torch.zeros(100, dtype=torch.float32)
+        actual = expected.clone()
+        actual[:6] = 0.5
+        with pytest.raises(AssertionError, match="The fraction of outliers"):
+            assert_tensor_close(
+                actual,
+                expected,
+                rtol=0,
+                atol=1,
+                max_outliers_fraction=0.05,
+                inlier_atol=0.1,
+            )
+
+
+class TestAssertCloseSafetensors:
+    @pytest.fixture(autouse=True)
+    def small_chunks(self, monkeypatch: pytest.MonkeyPatch):
+        # Force the comparison to go over multiple chunks per tensor.
+        from sharktank.utils import testing
+
+        monkeypatch.setattr(testing, "_SAFETENSORS_COMPARE_CHUNK_BYTES", 16)
+
+    def test_close(self, tmp_path: Path):
+        from safetensors.torch import save_file
+
+        tensors = {
+            "a": torch.rand(7, 3, dtype=torch.float32),
+            "b": torch.tensor(2.0, dtype=torch.float16),
+        }
+        save_file(tensors, tmp_path / "ref.safetensors")
+        save_file(tensors, tmp_path / "actual.safetensors")
+        assert_close_safetensors(
+            tmp_path / "actual.safetensors", tmp_path / "ref.safetensors"
+        )
+
+    def test_not_close_in_last_chunk(self, tmp_path: Path):
+        from safetensors.torch import save_file
+
+        ref = torch.rand(7, 3, dtype=torch.float32)
+        actual = ref.clone()
+        actual[-1, -1] += 1
+        save_file({"a": ref}, tmp_path / "ref.safetensors")
+        save_file({"a": actual}, tmp_path / "actual.safetensors")
+        with pytest.raises(AssertionError, match="Tensor-likes are not close") as e:
+            assert_close_safetensors(
+                tmp_path / "actual.safetensors", tmp_path / "ref.safetensors"
+            )
+        # Each row is its own chunk, so the mismatch is reported in the last one.
+        assert "Tensor a is not close in rows [6, 7)" in str(e.value)
+
+    def test_shape_mismatch(self, tmp_path: Path):
+        from safetensors.torch import save_file
+
+        save_file({"a": torch.zeros(7, 3)}, tmp_path / "ref.safetensors")
+        save_file({"a": torch.zeros(8, 3)}, tmp_path / "actual.safetensors")
+        with pytest.raises(AssertionError, match="Shape mismatch"):
+            assert_close_safetensors(
+                tmp_path / "actual.safetensors", tmp_path / "ref.safetensors"
+            )
+
+    def test_file_not_close_without_fail_fast(self, tmp_path: Path):
+        from safetensors.torch import save_file
+
+        ref = {"a": torch.zeros(3, 2), "b": torch.zeros(3, 2)}
+        actual = {"a": torch.ones(3, 2), "b": torch.zeros(3, 2)}
+        save_file(ref, tmp_path / "ref.safetensors")
+        save_file(actual, tmp_path / "actual.safetensors")
+        with pytest.raises(AssertionError, match=re.escape("Tensors ['a']")):
+            assert_close_safetensors(
+                tmp_path / "actual.safetensors",
+                tmp_path / "ref.safetensors",
+                fail_fast=False,
+            )
+
+    def test_unsupported_dtype(self, tmp_path: Path):
+        header = json.dumps(
+            {"a": {"dtype": "UNKNOWN", "shape": [2], "data_offsets": [0, 2]}}
+        ).encode()
+        for file_name in ["ref.safetensors", "actual.safetensors"]:
+            (tmp_path / file_name).write_bytes(
+                len(header).to_bytes(8, byteorder="little") + header + bytes(2)
+            )
+        with pytest.raises(NotImplementedError, match='dtype "UNKNOWN"'):
+            assert_close_safetensors(
+                tmp_path / "actual.safetensors",
+                tmp_path / "ref.safetensors",
+                fail_fast=False,
+            )
+
+    def test_directory_not_close_without_fail_fast(self, tmp_path: Path):
+        from safetensors.torch import save_file
+
+        for d in ["ref", "actual"]:
+            (tmp_path / d / "sub").mkdir(parents=True)
+        for i in range(4):
+            ref = torch.rand(5, 2, dtype=torch.float32)
+            actual = ref + 1 if i == 2 else ref
+            file_name = f"{i}.safetensors"
+            save_file({"a": ref}, tmp_path / "ref" / "sub" / file_name)
+            save_file({"a": actual}, tmp_path / "actual" / "sub" / file_name)
+        with pytest.raises(AssertionError, match="Tensors are not close"):
+            assert_close_safetensors(
+                tmp_path / "actual", tmp_path / "ref", fail_fast=False
+            )
+
+
+class TestStreamingTensorStats:
+    @pytest.mark.parametrize("dtype", [torch.bfloat16, torch.float32])
+    def test_matches_whole_tensor(
+        self, dtype: torch.dtype, monkeypatch: pytest.MonkeyPatch
+    ):
+        from sharktank.utils import testing
+
+        # Also split the chunks that get upcast into several sub-chunks.
+        monkeypatch.setattr(testing, "_STATS_SUB_CHUNK_NUMEL", 7)
+        # An offset from zero makes a naive sum-of-squares variance cancel.
+        t = (torch.randn(37, 5, generator=torch.Generator().manual_seed(0)) + 100).to(
+            dtype=dtype
+        )
+        stats = testing._StreamingTensorStats()
+        for chunk in t.split(6):
+            stats.update(chunk)
+
+        expected_std, expected_mean = torch.std_mean(t.to(dtype=torch.float64))
+        expected_min, expected_max = torch.aminmax(t)
+        assert stats.count == t.numel()
+        assert stats.dtype == dtype
+        assert stats.min == expected_min.item()
+        assert stats.max == expected_max.item()
+        assert stats.mean == pytest.approx(expected_mean.item(), rel=1e-6)
+        assert stats.std == pytest.approx(expected_std.item(), rel=1e-4)
+
+
+def _run_test_case(test_case_class: type[unittest.TestCase]) -> unittest.TestResult:
+    result = unittest.TestResult()
+    unittest.defaultTestLoader.loadTestsFromTestCase(test_case_class).run(result)
+    return result
+
+
+class TestTempDirTestBase:
+    def test_without_template(self):
+        temp_dirs = []
+
+        class NoTemplate(TempDirTestBase):
+            def test_f(self):
+                assert self._template_dir is None
+                assert list(self._temp_dir.iterdir()) == []
+                temp_dirs.append(self._temp_dir)
+
+        result = _run_test_case(NoTemplate)
+        assert result.wasSuccessful(), result.failures + result.errors
+        assert result.testsRun == 1
+        assert not temp_dirs[0].exists()
+
+    def test_populate_template(self):
+        template_dirs = []
+
+        class WithTemplate(TempDirTestBase):
+            @classmethod
+            def _populate_template(cls, template_dir: Path):
+                template_dirs.append(template_dir)
+                (template_dir / "sub").mkdir()
+                (template_dir / "sub" / "file.txt").write_text("template")
+
+            def test_a(self):
+                path = self._temp_dir / "sub" / "file.txt"
+                assert path.read_text() == "template"
+                path.write_text("modified")
+
+            def test_b(self):
+                path = self._temp_dir / "sub" / "file.txt"
+                assert path.read_text() == "template"
+                path.write_text("modified")
+
+        result = _run_test_case(WithTemplate)
+        assert result.wasSuccessful(), result.failures + result.errors
+        assert result.testsRun == 2
+        # The template is built once per class and removed afterwards.
+        assert len(template_dirs) == 1
+        assert not template_dirs[0].exists()
+
+    def test_keep_tmpdirs(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv(SHARKTANK_KEEP_TMPDIRS_ENV_VAR, "1")
+        dirs = []
+
+        class KeepDirs(TempDirTestBase):
+            @classmethod
+            def _populate_template(cls, template_dir: Path):
+                dirs.append(template_dir)
+
+            def test_f(self):
+                dirs.append(self._temp_dir)
+
+        try:
+            result = _run_test_case(KeepDirs)
+            assert result.wasSuccessful(), result.failures + result.errors
+            assert len(dirs) == 2
+            assert all(d.exists() for d in dirs)
+        finally:
+            for d in dirs:
+                shutil.rmtree(d, ignore_errors=True)
+
 
 def test_deterministic_random_seed(deterministic_random_seed):
     """Make the deterministic_random_seed fixture never changes RNG generation compared
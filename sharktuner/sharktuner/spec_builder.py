@@ -7,8 +7,11 @@
 # Given an input dispatch, this code modifies the hyperparameters
 # in the code and runs it.
 
+import functools
+
 from iree.compiler import ir  # type: ignore
 from iree.compiler.dialects import iree_codegen  # type: ignore
+from iree.compiler.dialects import transform  # type: ignore
 
 from .common import *
 from .dispatch_constraints import *
@@ -17,45 +20,79 @@ from .dispatch_parser import *
 ROOT_OP_ATTR_NAME = "root_op"
 
 
+def _print_without_root_op_attr(op: ir.Operation, has_root_attr: bool) -> str:
+    """Prints `op` without its `root_op` attribute.
+
+    The attribute would prevent matching of ops without the attr in the
+    resulting TD spec matcher. It is removed only while printing and the
+    original attribute is put back afterwards, since the op is connected to the
+    input module, which gets used for all candidates."""
+    if not has_root_attr:
+        return str(op)
+
+    root_attr = op.opview.attributes[ROOT_OP_ATTR_NAME]
+    del op.opview.attributes[ROOT_OP_ATTR_NAME]
+    try:
+        return str(op)
+    finally:
+        op.opview.attributes[ROOT_OP_ATTR_NAME] = root_attr
+
+
+def _get_arg_attrs(effects: list[str]) -> ir.ArrayAttr:
+    """Builds the per-argument attributes, e.g. `{transform.readonly}`."""
+    return ir.ArrayAttr.get(
+        [ir.DictAttr.get({effect: ir.UnitAttr.get()}) for effect in effects]
+    )
+
+
+def _create_kernel_config_entrypoint(
+    arg_effect: str,
+) -> tuple[transform.NamedSequenceOp, ir.Value]:
+    """Creates an empty `@__kernel_config` tuning spec entry point at the current
+    insertion point. Returns the op and its `%variant_op` argument. The caller is
+    responsible for populating the body, including the terminator."""
+    any_op = transform.AnyOpType.get()
+    entrypoint = transform.NamedSequenceOp(
+        "__kernel_config",
+        [any_op],
+        [any_op],
+        arg_attrs=_get_arg_attrs([arg_effect]),
+    )
+    entrypoint.operation.attributes[
+        "iree_codegen.tuning_spec_entrypoint"
+    ] = ir.UnitAttr.get()
+    return entrypoint, entrypoint.bodyTarget
+
+
+# The placeholder spec is the same for every candidate, so it is built once and
+# shared. The tuner uses a single context, so only the last one is cached.
+# Callers must not modify the returned module.
+@functools.lru_cache(maxsize=1)
 def get_placeholder_spec(context: ir.Context) -> ir.Module:
-    spec_text = f"""
-        module attributes {{ transform.with_named_sequence }} {{
-            transform.named_sequence
-            @__kernel_config(%variant_op: !transform.any_op {{transform.readonly}}) -> !transform.any_op
-                attributes {{ iree_codegen.tuning_spec_entrypoint }} {{
-                transform.yield %variant_op : !transform.any_op
-            }}
-        }}
-        """
-    return ir.Module.parse(spec_text, context)
+    with context, ir.Location.unknown():
+        module = ir.Module.create()
+        module.operation.attributes["transform.with_named_sequence"] = ir.UnitAttr.get()
+        with ir.InsertionPoint(module.body):
+            entrypoint, variant_op = _create_kernel_config_entrypoint(
+                "transform.readonly"
+            )
+            with ir.InsertionPoint(entrypoint.body):
+                transform.YieldOp([variant_op])
+        module.operation.verify()
+        return module
 
 
-# TODO(Max191): Use python bindings to build the transform dialect spec module
-# instead of using string formatting.
 def build_td_spec(
     context: ir.Context,
     op: ir.Operation,
     config_list: list[common.TuningConfiguration],
     func_name: str,
 ) -> ir.Module:
-    bbargs = []
-    # The `root_op` attribute will prevent matching of ops without the attr in
-    # the resulting TD spec matcher if it is not removed, so we remove it here.
-    # After removing, we must add it back, since the op is connected to the
-    # input module, which gets used for all candidates.
-    # TODO(Max191): Find a cleaner way to do this without removing and adding
-    # back the attribute.
     has_root_attr = ROOT_OP_ATTR_NAME in op.opview.attributes
     if has_root_attr:
         assert isinstance(
             op.opview.attributes[ROOT_OP_ATTR_NAME], ir.UnitAttr
         ), f"expected '{ROOT_OP_ATTR_NAME}' attr to be a unit attr"
-    if has_root_attr:
-        del op.opview.attributes[ROOT_OP_ATTR_NAME]
-    # Get the root op string for formatting the final spec.
-    root_operation = str(op)
-    if has_root_attr:
-        op.opview.attributes[ROOT_OP_ATTR_NAME] = ir.UnitAttr.get(op.context)
 
     if linalg.isa_contraction_op(op):
         # Temporary solution using custom contraction transform ops for contraction operations.
@@ -112,9 +149,10 @@ def build_td_spec(
     else:
         # Get the names ssa names of operands to make sure they match in the
         # template after string formatting.
-        captured_values: set[ir.Value] = set()
+        operand_types: dict[str, ir.Type] = {}
         for operand in op.operands:
-            if operand in captured_values:
+            ssa_name = operand.get_name()
+            if ssa_name in operand_types:
                 # TODO(Max191): Remove this warning when the transform for the
                 # `cast_compatible_dag_from_root` op fixes a bug in the matching
                 # logic that causes failure to match when the same operand is
@@ -124,11 +162,13 @@ def build_td_spec(
                     f"Root op has repeated operand. This can cause failure to match in the resulting TD spec at compile time."
                 )
                 continue
-            ssa_name = operand.get_name()
-            operand_type = operand.type
-            bbargs.append(f"{ssa_name}: {operand_type}")
-            captured_values.add(operand)
-        bbargs_str = ", ".join(bbargs)
+            operand_types[ssa_name] = operand.type
+        bbargs_str = ", ".join(
+            f"{ssa_name}: {operand_type}"
+            for ssa_name, operand_type in operand_types.items()
+        )
+        # Get the root op string for formatting the final spec.
+        root_operation = _print_without_root_op_attr(op, has_root_attr)
         matcher_block = f"""%ins, %outs = transform.iree.match.cast_compatible_dag_from_root %cont {{
               ^bb0({bbargs_str}):
               {root_operation}
@@ -148,39 +188,68 @@ def build_td_spec(
         ["!transform.any_op"] + ["!transform.any_param"] * len(yield_vars)
     )
 
-    annotation_args = ", ".join(
-        f"%cfg_{i}: !transform.any_param {{transform.readonly}}"
-        for i in range(len(config_list))
-    )
-    annotation_lines = "\n".join(
-        f'                transform.annotate %op "{config.name}" = %cfg_{i} : !transform.any_op, !transform.any_param'
-        for i, config in enumerate(config_list)
-    )
-
-    spec_text = f"""\
-        module attributes {{ transform.with_named_sequence, iree_codegen.tuning_spec_with_default_entrypoint }} {{
-        // Annotation Transform
-        transform.named_sequence @apply_op_config(%op: !transform.any_op {{transform.readonly}}, {annotation_args}) {{
-        {annotation_lines}
-            transform.yield
-        }}
-
-        // Custom Op Matcher
+    # The IREE matcher ops do not have python bindings and the matcher body
+    # embeds the printed root op, so the matcher sequence is still parsed from
+    # text. The rest of the spec is built directly with the bindings.
+    matcher_text = f"""\
+        module attributes {{ transform.with_named_sequence }} {{
         transform.named_sequence @{func_name}(%cont: !transform.any_op {{transform.readonly}})
             -> ({yield_types}) {{
             {matcher_block}
             {config_block}
             transform.yield {yield_list} : {yield_types}
         }}
-
-        // Entry Point
-        transform.named_sequence
-        @__kernel_config(%variant_op: !transform.any_op {{transform.consumed}}) -> !transform.any_op
-            attributes {{ iree_codegen.tuning_spec_entrypoint }} {{
-            %res = transform.foreach_match in %variant_op
-                @{func_name} -> @apply_op_config
-            : (!transform.any_op) -> !transform.any_op
-            transform.yield %res : !transform.any_op
-        }}
     }}"""
-    return ir.Module.parse(spec_text, context)
+
+    with context, ir.Location.unknown():
+        any_op = transform.AnyOpType.get()
+        any_param = transform.AnyParamType.get()
+        matcher_module = ir.Module.parse(matcher_text, context)
+
+        module = ir.Module.create()
+        module.operation.attributes["transform.with_named_sequence"] = ir.UnitAttr.get()
+        module.operation.attributes[
+            "iree_codegen.tuning_spec_with_default_entrypoint"
+        ] = ir.UnitAttr.get()
+        with ir.InsertionPoint(module.body):
+            # Annotation Transform
+            apply_op_config = transform.NamedSequenceOp(
+                "apply_op_config",
+                [any_op] + [any_param] * len(config_list),
+                [],
+                arg_attrs=_get_arg_attrs(
+                    ["transform.readonly"] * (len(config_list) + 1)
+                ),
+            )
+            with ir.InsertionPoint(apply_op_config.body):
+                for config, config_param in zip(
+                    config_list, apply_op_config.bodyExtraArgs
+                ):
+                    transform.AnnotateOp(
+                        apply_op_config.bodyTarget, config.name, param=config_param
+                    )
+                transform.YieldOp()
+
+            # Custom Op Matcher
+            module.body.append(
+                matcher_module.body.operations[0].operation.detach_from_parent()
+            )
+
+            # Entry Point
+            entrypoint, variant_op = _create_kernel_config_entrypoint(
+                "transform.consumed"
+            )
+            with ir.InsertionPoint(entrypoint.body):
+                foreach_match = transform.ForeachMatchOp(
+                    updated=any_op,
+                    forwarded_outputs=[],
+                    root=variant_op,
+                    forwarded_inputs=[],
+                    matchers=ir.ArrayAttr.get([ir.FlatSymbolRefAttr.get(func_name)]),
+                    actions=ir.ArrayAttr.get(
+                        [ir.FlatSymbolRefAttr.get("apply_op_config")]
+                    ),
+                )
+                transform.YieldOp([foreach_match.updated])
+        module.operation.verify()
+        return module
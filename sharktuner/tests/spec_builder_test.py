@@ -277,3 +277,73 @@ def test_spec_builder_with_batch_dims(tuner_ctx: common.TunerContext) -> None:
     assert "lhs_type = f16" in spec_str
     assert "rhs_type = f16" in spec_str
     assert "output_type = f32" in spec_str
+
+
+def test_get_placeholder_spec(tuner_ctx: common.TunerContext) -> None:
+    spec_module = spec_builder.get_placeholder_spec(tuner_ctx.mlir_ctx)
+    spec_str = str(spec_module)
+    assert "transform.with_named_sequence" in spec_str
+    assert "@__kernel_config" in spec_str
+    assert "iree_codegen.tuning_spec_entrypoint" in spec_str
+    assert "transform.yield %arg0 : !transform.any_op" in spec_str
+
+    # The placeholder is only built once per context.
+    assert spec_builder.get_placeholder_spec(tuner_ctx.mlir_ctx) is spec_module
+
+
+def test_spec_builder_generic_root_op(tuner_ctx: common.TunerContext) -> None:
+    # A convolution written as a `linalg.generic`, whose only discardable
+    # attribute is `root_op`. It is not a contraction, so the spec embeds the
+    # printed op in a `cast_compatible_dag_from_root` matcher.
+    module_str = """
+        builtin.module {
+            func.func @conv_1d(%arg0: tensor<34xf32>, %arg1: tensor<3xf32>, %arg2: tensor<32xf32>) -> tensor<32xf32> {
+                %0 = linalg.generic {
+                    indexing_maps = [affine_map<(d0, d1) -> (d0 + d1)>,
+                                     affine_map<(d0, d1) -> (d1)>,
+                                     affine_map<(d0, d1) -> (d0)>],
+                    iterator_types = ["parallel", "reduction"]}
+                    ins(%arg0, %arg1 : tensor<34xf32>, tensor<3xf32>)
+                    outs(%arg2 : tensor<32xf32>) attrs = {root_op} {
+                ^bb0(%in: f32, %in_0: f32, %out: f32):
+                    %1 = arith.mulf %in, %in_0 : f32
+                    %2 = arith.addf %out, %1 : f32
+                    linalg.yield %2 : f32
+                } -> tensor<32xf32>
+                return %0 : tensor<32xf32>
+            }
+        }"""
+    module = ir.Module.parse(module_str, tuner_ctx.mlir_ctx)
+    root_ops = iree_codegen.get_tuner_root_ops(module)
+    assert len(root_ops) == 1, "Expected exactly one root op"
+    root_op = root_ops[0]
+    assert not linalg.isa_contraction_op(root_op)
+
+    attributes = ir.DictAttr.get({"reduction": ir.ArrayAttr.get([])})
+    lowering_config = iree_gpu.LoweringConfigAttr.get(attributes)
+    pipeline_attr = iree_codegen.DispatchLoweringPassPipelineAttr.get(
+        iree_codegen.DispatchLoweringPassPipeline.None_
+    )
+    translation_info = iree_codegen.TranslationInfoAttr.get(pipeline_attr)
+    compilation_info = iree_codegen.CompilationInfoAttr.get(
+        lowering_config, translation_info
+    )
+
+    spec_module = spec_builder.build_td_spec(
+        tuner_ctx.mlir_ctx,
+        root_op,
+        [
+            common.TuningConfiguration(
+                name="compilation_info", configuration=compilation_info
+            )
+        ],
+        "match_conv_1d",
+    )
+    spec_str = str(spec_module)
+    assert "@match_conv_1d -> @apply_op_config" in spec_str
+    assert "transform.iree.match.cast_compatible_dag_from_root" in spec_str
+    assert "linalg.generic" in spec_str
+    assert "root_op" not in spec_str
+
+    # The attribute is restored on the op in the input module.
+    assert "root_op" in root_op.opview.attributes